@@ -14,21 +14,644 @@ caiwingfield.net
 2017
 ---------------------------
 """
-import glob
+import contextlib
+import itertools
+import json
 import logging
+import stat
+import threading
+import zipfile
 
-from typing import List
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, NamedTuple, TextIO, Tuple
 from abc import ABCMeta, abstractmethod
 from enum import Enum, auto
 
 import os
 
+import numpy
+import scipy
+import scipy.io
+import scipy.sparse
+from scipy.sparse._sparsetools import coo_tocsr
+
+try:
+    import fast_matrix_market
+except ImportError:
+    fast_matrix_market = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+try:
+    import threadpoolctl
+except ImportError:
+    threadpoolctl = None
+
+# scipy 1.12+ reads and writes matrix market files with its own copy of fast_matrix_market's
+# C++ core, which is much faster than parse_mtx_coo and also releases the GIL
+_SCIPY_MMIO_IS_NATIVE = tuple(int(part) for part in scipy.__version__.split(".")[:2]) >= (1, 12)
+
 logger = logging.getLogger()
 
+# Number of entries to parse at a time when streaming a matrix market file
+_CHUNK_SIZE = 1 << 20
+
+# Size in bytes from which dense matrices are streamed rather than read whole by a native parser
+STREAM_THRESHOLD_BYTES = 1 << 30
+
 logger_format = '%(asctime)s | %(levelname)s | %(module)s | %(message)s'
 logger_dateformat = "%Y-%m-%d %H:%M:%S"
 
 
+class MtxHeader(NamedTuple):
+    """
+    The header of a matrix market file.
+    """
+    # "array" or "coordinate"
+    format: str
+    # "real", "double", "integer", "complex" or "pattern"
+    field: str
+    # "general", "symmetric", "skew-symmetric" or "hermitian"
+    symmetry: str
+    shape: Tuple[int, int]
+    # Number of stored entries
+    nnz: int
+
+    @property
+    def dtype(self) -> numpy.dtype:
+        """
+        The numpy dtype of the values in the file.
+        """
+        if self.field == "integer":
+            return numpy.dtype(numpy.int64)
+        if self.field == "complex":
+            return numpy.dtype(numpy.complex128)
+        return numpy.dtype(numpy.float64)
+
+
+def _read_data_line(f: TextIO) -> str:
+    """
+    Read the next line of an open matrix market file which isn't blank or a comment.
+    Returns "" at the end of the file.
+    """
+    line = f.readline()
+    while line.startswith("%") or (line and not line.strip()):
+        line = f.readline()
+    return line
+
+
+def read_mtx_header(f: TextIO) -> MtxHeader:
+    """
+    Read the header of an open matrix market file.
+    Leaves the file positioned at the first entry.
+    """
+    banner = f.readline().split()
+    if len(banner) != 5 or banner[0].lower() != "%%matrixmarket":
+        raise ValueError("Not a matrix market file")
+    mtx_format, field, symmetry = (token.lower() for token in banner[2:])
+
+    # Skip comments and blank lines to reach the size line
+    sizes = [int(size) for size in _read_data_line(f).split()]
+
+    if mtx_format == "array":
+        rows, cols = sizes
+        nnz = rows * cols
+    else:
+        rows, cols, nnz = sizes
+
+    return MtxHeader(mtx_format, field, symmetry, (rows, cols), nnz)
+
+
+def iter_mtx_entries(source_file: TextIO, header: MtxHeader, entry_dtype: numpy.dtype) -> Iterator[numpy.ndarray]:
+    """
+    Yield the entries of an open matrix market file in chunks, from its first entry.
+    Raises ValueError unless there are exactly as many entries as the header says.
+    """
+    parsed = 0
+    while parsed < header.nnz:
+        # Start each chunk at an entry, so it always parses to at least one
+        first_line = _read_data_line(source_file)
+        if not first_line:
+            raise ValueError(f"Truncated file: expected {header.nnz} entries but found {parsed}")
+        lines = itertools.chain([first_line],
+                                itertools.islice(source_file, min(_CHUNK_SIZE, header.nnz - parsed) - 1))
+        entries = numpy.loadtxt(lines, dtype=entry_dtype, comments="%", ndmin=1)
+        parsed += len(entries)
+        yield entries
+
+    # Only blank lines and comments may follow the last entry
+    if _read_data_line(source_file):
+        raise ValueError(f"Too many entries: expected {header.nnz}")
+
+
+def iter_mtx_array_values(source_file: TextIO, header: MtxHeader) -> Iterator[numpy.ndarray]:
+    """
+    Yield the (column-major) values of an open dense matrix market file in chunks.
+    """
+    # Complex values are stored as pairs of reals
+    if header.field == "complex":
+        entry_dtype = numpy.dtype([("real", numpy.float64), ("imag", numpy.float64)])
+    else:
+        entry_dtype = header.dtype
+    for entries in iter_mtx_entries(source_file, header, entry_dtype):
+        yield entries.view(header.dtype)
+
+
+def read_mtx_array_to_memmap(source_file: TextIO, header: MtxHeader, memmap_path: str) -> numpy.memmap:
+    """
+    Stream the values of an open general dense matrix market file into a disk-backed array, so
+    the whole matrix never needs to be resident in memory.
+    """
+    # Matrix market arrays are stored column-major
+    matrix = numpy.memmap(memmap_path, mode="w+", dtype=header.dtype, shape=header.shape, order="F")
+    values = matrix.reshape(-1, order="F")
+    start = 0
+    for chunk in iter_mtx_array_values(source_file, header):
+        values[start:start + len(chunk)] = chunk
+        start += len(chunk)
+    matrix.flush()
+    return matrix
+
+
+def should_stream_mtx_array(header: MtxHeader) -> bool:
+    """
+    Whether to stream a dense matrix market file's values rather than read it whole: only for
+    large general arrays, or when there is no native parser.
+    """
+    # Symmetric files only store half of the matrix, and coordinate files are sparse
+    if header.format != "array" or header.symmetry != "general" or header.nnz == 0:
+        return False
+    if fast_matrix_market is None and not _SCIPY_MMIO_IS_NATIVE:
+        return True
+    return header.nnz * header.dtype.itemsize >= STREAM_THRESHOLD_BYTES
+
+
+def _index_dtype(shape: Tuple[int, int], nnz: int) -> numpy.dtype:
+    """
+    The narrowest index dtype scipy will use for a sparse matrix of this size.
+    """
+    return numpy.dtype(numpy.int32 if max(*shape, nnz) < 2**31 else numpy.int64)
+
+
+def parse_mtx_coo(source_path: str) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, Tuple[int, int]]:
+    """
+    Parse a coordinate matrix market file into (data, row, col, shape) COO arrays, with
+    zero-based indices and symmetric entries generalised.
+    """
+    with open(source_path) as source_file:
+        header = read_mtx_header(source_file)
+        if header.format != "coordinate":
+            raise ValueError("Not a coordinate matrix market file")
+
+        index_dtype = _index_dtype(header.shape, header.nnz)
+        row = numpy.empty(header.nnz, dtype=index_dtype)
+        col = numpy.empty(header.nnz, dtype=index_dtype)
+        data = numpy.empty(header.nnz, dtype=header.dtype)
+
+        # Indices are parsed straight into the index dtype
+        entry_dtype = [("row", index_dtype), ("col", index_dtype)]
+        if header.field == "complex":
+            entry_dtype += [("real", numpy.float64), ("imag", numpy.float64)]
+        elif header.field != "pattern":
+            entry_dtype += [("value", header.dtype)]
+
+        filled = 0
+        for entries in iter_mtx_entries(source_file, header, numpy.dtype(entry_dtype)):
+            stop = filled + len(entries)
+            # Matrix market indices are one-based
+            numpy.subtract(entries["row"], 1, out=row[filled:stop])
+            numpy.subtract(entries["col"], 1, out=col[filled:stop])
+            if header.field == "complex":
+                data[filled:stop].real = entries["real"]
+                data[filled:stop].imag = entries["imag"]
+            elif header.field == "pattern":
+                data[filled:stop] = 1
+            else:
+                data[filled:stop] = entries["value"]
+            filled = stop
+
+    if header.symmetry != "general":
+        # Mirror the entries off the diagonal
+        off_diagonal = row != col
+        mirrored_data = data[off_diagonal]
+        if header.symmetry == "skew-symmetric":
+            mirrored_data = -mirrored_data
+        elif header.symmetry == "hermitian":
+            mirrored_data = mirrored_data.conj()
+        row, col = numpy.concatenate((row, col[off_diagonal])), numpy.concatenate((col, row[off_diagonal]))
+        data = numpy.concatenate((data, mirrored_data))
+
+    return data, row, col, header.shape
+
+
+def _resolve_engine(engine: str) -> str:
+    """
+    Resolve a MatrixMarket engine name to either "fmm" or "scipy".
+    "auto" uses fast_matrix_market when it is installed, else scipy.
+    """
+    if engine == "auto":
+        return "fmm" if fast_matrix_market is not None else "scipy"
+    if engine == "fmm" and fast_matrix_market is None:
+        raise ImportError("fast_matrix_market is not installed")
+    if engine not in ("fmm", "scipy"):
+        raise ValueError(engine)
+    return engine
+
+
+def read_mtx(source_path: str, engine: str = "auto", parallelism: int = None):
+    """
+    Read a matrix market file, as an ndarray for array files and a COO matrix for coordinate files.
+    parallelism is the number of threads fast_matrix_market uses, by default one per CPU.
+    """
+    if _resolve_engine(engine) == "fmm":
+        return fast_matrix_market.mmread(source_path, parallelism=parallelism or os.cpu_count())
+    return scipy.io.mmread(source_path)
+
+
+def read_mtx_csr(source_path: str, engine: str = "auto", parallelism: int = None) -> scipy.sparse.csr_matrix:
+    """
+    Read a coordinate matrix market file into a CSR matrix, without an intermediate COO matrix.
+    """
+    if _resolve_engine(engine) == "fmm":
+        (data, (row, col)), shape = fast_matrix_market.read_coo(source_path,
+                                                                parallelism=parallelism or os.cpu_count())
+    elif _SCIPY_MMIO_IS_NATIVE:
+        coo = scipy.io.mmread(source_path)
+        data, row, col, shape = coo.data, coo.row, coo.col, coo.shape
+        del coo
+    else:
+        data, row, col, shape = parse_mtx_coo(source_path)
+
+    n_rows, n_cols = shape
+    nnz = len(data)
+    index_dtype = _index_dtype(shape, nnz)
+    row = row.astype(index_dtype, copy=False)
+    col = col.astype(index_dtype, copy=False)
+
+    indptr = numpy.empty(n_rows + 1, dtype=index_dtype)
+    indices = numpy.empty(nnz, dtype=index_dtype)
+    values = numpy.empty(nnz, dtype=data.dtype)
+    coo_tocsr(n_rows, n_cols, nnz, row, col, data, indptr, indices, values)
+    del data, row, col
+
+    matrix = scipy.sparse.csr_matrix((values, indices, indptr), shape=shape, copy=False)
+    matrix.sum_duplicates()
+    return matrix
+
+
+def _narrowest_int_dtype(lo: int, hi: int) -> numpy.dtype:
+    """
+    The narrowest integer dtype holding every value from lo to hi; unsigned if lo isn't negative.
+    """
+    if lo < 0:
+        candidates = (numpy.int8, numpy.int16, numpy.int32, numpy.int64)
+    else:
+        candidates = (numpy.uint8, numpy.uint16, numpy.uint32, numpy.uint64)
+    for candidate in candidates:
+        info = numpy.iinfo(candidate)
+        if info.min <= lo and hi <= info.max:
+            return numpy.dtype(candidate)
+    raise ValueError(f"No integer dtype holds {lo} to {hi}")
+
+
+def narrow_sparse_dtypes(matrix: scipy.sparse.csr_matrix, narrow_values: bool = False) -> scipy.sparse.csr_matrix:
+    """
+    Store a CSR matrix in the narrowest dtypes which hold it exactly.
+    Integer values are only narrowed with narrow_values, as arithmetic on them can then overflow.
+    """
+    index_dtype = _index_dtype(matrix.shape, matrix.nnz)
+    matrix.indices = matrix.indices.astype(index_dtype, copy=False)
+    matrix.indptr = matrix.indptr.astype(index_dtype, copy=False)
+
+    if narrow_values and numpy.issubdtype(matrix.data.dtype, numpy.integer) and matrix.nnz > 0:
+        matrix.data = matrix.data.astype(_narrowest_int_dtype(matrix.data.min(), matrix.data.max()), copy=False)
+
+    return matrix
+
+
+def write_mtx(target_path: str, matrix, detect_symmetry: bool = False, engine: str = "auto",
+              parallelism: int = None) -> None:
+    """
+    Write a matrix market file.
+    Matrices are written as general unless detect_symmetry is set, as detecting symmetry is slow.
+    """
+    if _resolve_engine(engine) == "fmm":
+        if detect_symmetry:
+            fast_matrix_market.mmwrite(target_path, matrix, symmetry="AUTO", find_symmetry=True,
+                                       parallelism=parallelism or os.cpu_count())
+        else:
+            fast_matrix_market.mmwrite(target_path, matrix, symmetry="general",
+                                       parallelism=parallelism or os.cpu_count())
+    else:
+        # scipy detects symmetry when none is given
+        scipy.io.mmwrite(target_path, matrix, symmetry=None if detect_symmetry else "general")
+
+
+def limit_native_threads(parallelism: int):
+    """
+    Limit the threads of native libraries, including scipy's matrix market reader and writer.
+    Returns a context manager restoring the previous limits. Does nothing without threadpoolctl.
+    """
+    if threadpoolctl is None:
+        return contextlib.nullcontext()
+    return threadpoolctl.threadpool_limits(parallelism)
+
+
+def resolve_backend(backend: str) -> str:
+    """
+    Resolve a parallel backend name to either "thread" or "process".
+    "auto" uses threads when a matrix market parser which releases the GIL is available.
+    """
+    if backend == "auto":
+        return "thread" if fast_matrix_market is not None or _SCIPY_MMIO_IS_NATIVE else "process"
+    if backend not in ("thread", "process"):
+        raise ValueError(backend)
+    return backend
+
+
+def iter_source_paths(source_dir: str, source_ext: str) -> Iterator[str]:
+    """
+    Yield the paths of the files in a directory with the given extension, as they are listed.
+    """
+    with os.scandir(source_dir) as entries:
+        for entry in entries:
+            # Match glob's "*" + ext, which skips hidden files
+            if entry.name.startswith(".") or not entry.name.endswith(source_ext):
+                continue
+            if entry.is_file():
+                yield entry.path
+
+
+# Zip compression method and level for each compression policy
+COMPRESSION_POLICIES = {
+    # Stored, not deflated: fastest to read and write
+    "none": (zipfile.ZIP_STORED, None),
+    "fast": (zipfile.ZIP_DEFLATED, 1),
+    "best": (zipfile.ZIP_DEFLATED, 9),
+}
+
+
+def save_arrays_npz(target_path: str, arrays: Dict[str, numpy.ndarray], compress: str = "none") -> None:
+    """
+    Save named arrays to an npz file, with one of the COMPRESSION_POLICIES.
+    Arrays are never pickled.
+    """
+    compression, compress_level = COMPRESSION_POLICIES[compress]
+    with zipfile.ZipFile(target_path, mode="w", compression=compression, compresslevel=compress_level,
+                         allowZip64=True) as zip_file:
+        for name, array in arrays.items():
+            with zip_file.open(name + ".npy", mode="w", force_zip64=True) as entry:
+                _write_npy(entry, numpy.asanyarray(array))
+
+
+# Size of the slices of an array's buffer written at a time
+_WRITE_CHUNK_BYTES = 4 << 20
+
+
+def _write_npy(f, array: numpy.ndarray) -> None:
+    """
+    Write an array in .npy format to a file-like object, straight from its buffer.
+    """
+    if array.dtype.hasobject:
+        raise ValueError("Object arrays can't be saved without pickling")
+    if not (array.flags.c_contiguous or array.flags.f_contiguous):
+        array = numpy.ascontiguousarray(array)
+
+    header = numpy.lib.format.header_data_from_array_1_0(array)
+    try:
+        numpy.lib.format.write_array_header_1_0(f, header)
+    except ValueError:
+        # Header too long for version 1.0
+        numpy.lib.format.write_array_header_2_0(f, header)
+
+    # A Fortran-ordered array's transpose is C-contiguous over the same buffer
+    buffer = array.T if header["fortran_order"] else array
+    data = memoryview(buffer.reshape(-1).view(numpy.uint8))
+    for start in range(0, len(data), _WRITE_CHUNK_BYTES):
+        f.write(data[start:start + _WRITE_CHUNK_BYTES])
+
+
+def save_array_npz(target_path: str, array: numpy.ndarray, compress: str = "none") -> None:
+    """
+    Save a single array to an npz file, as "arr_0" (like numpy.savez).
+    """
+    save_arrays_npz(target_path, {"arr_0": array}, compress)
+
+
+def stream_mtx_array_to_npz(source_file: TextIO, header: MtxHeader, target_path: str, compress: str = "none") -> None:
+    """
+    Write the values of an open general dense matrix market file into the "arr_0" entry of an
+    npz file as they are parsed, so the matrix is never held in memory or on disk in between.
+    """
+    compression, compress_level = COMPRESSION_POLICIES[compress]
+    try:
+        with zipfile.ZipFile(target_path, mode="w", compression=compression, compresslevel=compress_level,
+                             allowZip64=True) as zip_file:
+            with zip_file.open("arr_0.npy", mode="w", force_zip64=True) as entry:
+                # The values are column-major, so the array is saved in Fortran order
+                numpy.lib.format.write_array_header_1_0(entry, {
+                    "descr": numpy.lib.format.dtype_to_descr(header.dtype),
+                    "fortran_order": True,
+                    "shape": header.shape,
+                })
+                for chunk in iter_mtx_array_values(source_file, header):
+                    entry.write(memoryview(chunk.view(numpy.uint8)))
+    except Exception:
+        # Don't leave a truncated file behind
+        if os.path.isfile(target_path):
+            os.remove(target_path)
+        raise
+
+
+def sparse_npz_arrays(matrix: scipy.sparse.csr_matrix) -> Dict[str, numpy.ndarray]:
+    """
+    The named arrays scipy.sparse.save_npz stores for a CSR matrix.
+    """
+    return {
+        "indices": matrix.indices,
+        "indptr": matrix.indptr,
+        "format": numpy.array(matrix.format.encode("ascii")),
+        "shape": numpy.array(matrix.shape),
+        "data": matrix.data,
+    }
+
+
+def save_sparse_npz(target_path: str, matrix: scipy.sparse.csr_matrix, compress: str = "none") -> None:
+    """
+    Save a CSR matrix to an npz file which can be read with scipy.sparse.load_npz.
+    """
+    save_arrays_npz(target_path, sparse_npz_arrays(matrix), compress)
+
+
+class NpzBundle(object):
+    """
+    A single npz file holding the arrays of many matrices, which threads can add to.
+    Each matrix's arrays are stored under its name, e.g. "matrix/data".
+    """
+    def __init__(self, path: str, compress: str = "none"):
+        compression, compress_level = COMPRESSION_POLICIES[compress]
+        # Mode "x" raises FileExistsError rather than overwriting
+        self.path = path
+        self._zip_file = zipfile.ZipFile(path, mode="x", compression=compression, compresslevel=compress_level,
+                                         allowZip64=True)
+        # Zip entries can only be written one at a time
+        self._lock = threading.Lock()
+
+    def add(self, name: str, arrays: Dict[str, numpy.ndarray]) -> None:
+        """
+        Add a matrix's named arrays to the bundle.
+        """
+        with self._lock:
+            for key, array in arrays.items():
+                with self._zip_file.open(f"{name}/{key}.npy", mode="w", force_zip64=True) as entry:
+                    _write_npy(entry, numpy.asanyarray(array))
+
+    def close(self) -> None:
+        self._zip_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        # Don't leave a partial bundle behind, which would stop a rerun from creating it
+        if exc_type is not None:
+            os.remove(self.path)
+
+
+def _require_h5py() -> None:
+    if h5py is None:
+        raise ImportError("h5py is required for HDF5 files")
+
+
+def save_sparse_h5(target_path: str, matrix: scipy.sparse.csr_matrix) -> None:
+    """
+    Save a CSR matrix to an HDF5 file, as chunked, lzf-compressed indptr, indices and data
+    datasets, plus its shape.
+    """
+    _require_h5py()
+    with h5py.File(target_path, mode="w", libver="latest") as h5_file:
+        h5_file.attrs["format"] = matrix.format
+        h5_file.create_dataset("shape", data=numpy.array(matrix.shape))
+        for name in ("indptr", "indices", "data"):
+            array = getattr(matrix, name)
+            # h5py can't chunk empty datasets
+            if array.size == 0:
+                h5_file.create_dataset(name, data=array)
+            else:
+                h5_file.create_dataset(name, data=array, chunks=True, compression="lzf")
+
+
+def load_sparse_h5(source_path: str) -> scipy.sparse.csr_matrix:
+    """
+    Load a CSR matrix saved with save_sparse_h5.
+    """
+    _require_h5py()
+    with h5py.File(source_path, mode="r") as h5_file:
+        return scipy.sparse.csr_matrix(
+            (h5_file["data"][()], h5_file["indices"][()], h5_file["indptr"][()]),
+            shape=tuple(h5_file["shape"][()]))
+
+
+# Version of the binsparse spec written by save_binsparse
+BINSPARSE_VERSION = "0.1"
+
+
+def save_binsparse(target_path: str, matrix: scipy.sparse.csr_matrix) -> None:
+    """
+    Save a CSR matrix to a binsparse HDF5 file: pointers_to_1, indices_1 and values datasets,
+    described by a json "binsparse" attribute on the root group.
+    """
+    _require_h5py()
+    values = matrix.data
+    values_type = values.dtype.name
+    if numpy.iscomplexobj(values):
+        # Binsparse stores complex values as pairs of reals
+        values_type = f"complex[{values.real.dtype.name}]"
+        values = values.view(values.real.dtype).reshape(-1, 2)
+
+    descriptor = {
+        "version": BINSPARSE_VERSION,
+        "format": "CSR",
+        "shape": list(matrix.shape),
+        "number_of_stored_values": int(matrix.nnz),
+        "data_types": {
+            "pointers_to_1": matrix.indptr.dtype.name,
+            "indices_1": matrix.indices.dtype.name,
+            "values": values_type,
+        },
+    }
+    with h5py.File(target_path, mode="w", libver="latest") as h5_file:
+        h5_file.create_dataset("pointers_to_1", data=matrix.indptr)
+        h5_file.create_dataset("indices_1", data=matrix.indices)
+        h5_file.create_dataset("values", data=values)
+        h5_file.attrs["binsparse"] = json.dumps({"binsparse": descriptor})
+
+
+def load_binsparse(source_path: str) -> scipy.sparse.csr_matrix:
+    """
+    Load a CSR matrix from a binsparse HDF5 file.
+    """
+    _require_h5py()
+    with h5py.File(source_path, mode="r") as h5_file:
+        descriptor = json.loads(h5_file.attrs["binsparse"])["binsparse"]
+        if descriptor["format"] != "CSR":
+            raise ValueError(f"Unsupported binsparse format {descriptor['format']}")
+        values = h5_file["values"][()]
+        if descriptor["data_types"]["values"].startswith("complex"):
+            values = numpy.ascontiguousarray(values).view(numpy.result_type(values.dtype, numpy.complex64)).ravel()
+        return scipy.sparse.csr_matrix(
+            (values, h5_file["indices_1"][()], h5_file["pointers_to_1"][()]),
+            shape=tuple(descriptor["shape"]))
+
+
+def _chunk_path(index_path: str, chunk: int) -> str:
+    return f"{os.path.splitext(index_path)[0]}.{chunk:03d}.npy"
+
+
+def save_array_chunks(index_path: str, array: numpy.ndarray, chunks: int) -> None:
+    """
+    Save an array as row-slab .npy shards written concurrently, with a json index.
+    Shards are named after the index, e.g. matrix.json -> matrix.000.npy, matrix.001.npy, ...
+    """
+    boundaries = numpy.linspace(0, array.shape[0], num=chunks + 1, dtype=int).tolist()
+    shards = [
+        {"file": os.path.basename(_chunk_path(index_path, chunk)), "start": start, "stop": stop}
+        for chunk, (start, stop) in enumerate(zip(boundaries[:-1], boundaries[1:]))
+    ]
+
+    with ThreadPoolExecutor(max_workers=chunks) as executor:
+        futures = [
+            executor.submit(numpy.save, _chunk_path(index_path, chunk), array[shard["start"]:shard["stop"]],
+                            allow_pickle=False)
+            for chunk, shard in enumerate(shards)
+        ]
+        for future in as_completed(futures):
+            future.result()
+
+    # Write the index last, so its presence means the shards are complete
+    with open(index_path, mode="w") as index_file:
+        json.dump({"shape": list(array.shape), "dtype": array.dtype.str, "chunks": shards}, index_file)
+
+
+def load_array_chunks(index_path: str) -> numpy.ndarray:
+    """
+    Load an array saved with save_array_chunks.
+    """
+    with open(index_path) as index_file:
+        index = json.load(index_file)
+
+    index_dir = os.path.dirname(index_path)
+    array = numpy.empty(index["shape"], dtype=numpy.dtype(index["dtype"]))
+    for shard in index["chunks"]:
+        array[shard["start"]:shard["stop"]] = numpy.load(os.path.join(index_dir, shard["file"]), mmap_mode="r")
+    return array
+
+
 class ExecutionMode(Enum):
     """
     The mode of execution for the program.
@@ -46,6 +669,33 @@ class ExecutionMode(Enum):
     all_to_dir = auto()
 
 
+@dataclass(frozen=True)
+class PathInfo:
+    """
+    Filesystem facts about the source and target paths given in the CLI arguments.
+    Gathered with one stat per path, and passed around instead of re-querying the filesystem.
+    """
+    source_is_dir: bool
+    target_is_dir: bool
+
+    @classmethod
+    def from_args(cls, args) -> "PathInfo":
+        source_stat = _stat_or_none(args.source)
+        target_stat = _stat_or_none(args.target) if args.target else None
+        return cls(
+            source_is_dir=source_stat is not None and stat.S_ISDIR(source_stat.st_mode),
+            target_is_dir=target_stat is not None and stat.S_ISDIR(target_stat.st_mode),
+        )
+
+
+def _stat_or_none(path: str):
+    try:
+        return os.stat(path)
+    except OSError:
+        # Like os.path.isdir, treat any error as the path not being there
+        return None
+
+
 class Converter(object, metaclass=ABCMeta):
     """
     Converts one kind of file to another.
@@ -55,49 +705,112 @@ class Converter(object, metaclass=ABCMeta):
         self.source_ext = source_ext
         # Extension of the target file
         self.target_ext = target_ext
+        # How to determine the source and target paths in each mode
+        self._path_handlers = {
+            ExecutionMode.file_to_file: self._paths_file_to_file,
+            ExecutionMode.file_to_dir: self._paths_file_to_dir,
+            ExecutionMode.file_in_place: self._paths_file_in_place,
+            ExecutionMode.all_to_dir: self._paths_all_to_dir,
+            ExecutionMode.all_in_place: self._paths_all_in_place,
+        }
 
     @abstractmethod
-    def convert_file(self, source_path: str, target_path: str, skip: bool) -> None:
+    def convert_file(self, source_path: str, target_path: str, skip: bool, parallelism: int = None) -> None:
         """
         Convert a single file.
+        parallelism is the number of threads to read or write it with, by default one per CPU.
         """
         raise NotImplementedError()
 
-    def convert_files(self, source_paths: List[str], target_dir: str, skip: bool) -> None:
+    def load_arrays(self, source_path: str, parallelism: int = None) -> Dict[str, numpy.ndarray]:
         """
-        Convert multiple files.
+        Load a single file as the named arrays it would be saved as in an npz file.
+        Only needed by converters which support bundling.
         """
-        for source_path in source_paths:
-            source_filename = os.path.basename(source_path)
-            target_filename = os.path.splitext(source_filename)[0] + self.target_ext
-            target_path = os.path.join(target_dir, target_filename)
+        raise NotImplementedError(f"{type(self).__name__} can't bundle files")
 
-            self.convert_file(source_path, target_path, skip)
+    def bundle_file(self, source_path: str, bundle: NpzBundle, parallelism: int = None) -> None:
+        """
+        Convert a single file into a bundle.
+        """
+        source_filename = os.path.basename(source_path)
+        logger.info("Loading %s", source_filename)
+        arrays = self.load_arrays(source_path, parallelism)
+        logger.info("Bundling %s", source_filename)
+        bundle.add(os.path.splitext(source_filename)[0], arrays)
+
+    def convert_files(self, source_paths: Iterable[str], target_dir: str, skip: bool,
+                      jobs: int = None, backend: str = "auto", bundle: NpzBundle = None) -> None:
+        """
+        Convert multiple files in parallel.
+        If a bundle is given, all files are converted into it instead of to target_dir.
+        """
+        # When skipping, list the target directory once rather than checking each target.
+        # Targets not in the listing are still checked by convert_file before writing.
+        existing_filenames = set(os.listdir(target_dir)) if skip and bundle is None else set()
+
+        # Processes can't share the bundle, so it is always added to from threads
+        if bundle is not None:
+            backend = "thread"
+
+        executor_class = ProcessPoolExecutor if resolve_backend(backend) == "process" else ThreadPoolExecutor
+        max_workers = jobs or os.cpu_count()
+        # Share the CPUs between the workers, rather than each reading or writing with all of them
+        parallelism = max(1, os.cpu_count() // max_workers)
+        # scipy has no per-call parallelism, so its threads are limited for the whole batch.
+        # Worker processes don't inherit the limit, so each sets its own.
+        initializer = limit_native_threads if executor_class is ProcessPoolExecutor else None
+        executor = executor_class(max_workers=max_workers, initializer=initializer, initargs=(parallelism,))
+        with limit_native_threads(parallelism), executor:
+            futures = set()
+            for source_path in source_paths:
+                source_filename = os.path.basename(source_path)
+                target_filename = os.path.splitext(source_filename)[0] + self.target_ext
+                target_path = os.path.join(target_dir, target_filename)
+
+                if target_filename in existing_filenames:
+                    logger.info("%s already exists, so skipping %s", target_filename, source_filename)
+                    continue
+
+                # Bound the conversions in flight, rather than draining the whole listing up front
+                if len(futures) >= 2 * max_workers:
+                    done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+
+                if bundle is not None:
+                    futures.add(executor.submit(self.bundle_file, source_path, bundle, parallelism))
+                else:
+                    futures.add(executor.submit(self.convert_file, source_path, target_path, skip, parallelism))
+
+            # Surface any exceptions raised by the conversions
+            for future in as_completed(futures):
+                future.result()
 
     @classmethod
-    def validate_args(cls, args) -> None:
+    def validate_args(cls, args, path_info: PathInfo) -> None:
         """
         Make sure specified args are in a legal state.
         Raise errors if not.
         """
 
         # recursive => source is dir
-        if args.recursive and not os.path.isdir(args.source):
+        if args.recursive and not path_info.source_is_dir:
             logger.error("Use recursive option with and only with directories.")
             raise NotADirectoryError(args.source)
 
         # recursive => target is dir (if specified)
-        if args.recursive and args.target and not os.path.isdir(args.target):
+        if args.recursive and args.target and not path_info.target_is_dir:
             logger.error("Use recursive option with and only with directories.")
             raise NotADirectoryError(args.target)
 
         # source is dir => recursive
-        if os.path.isdir(args.source) and not args.recursive:
+        if path_info.source_is_dir and not args.recursive:
             logger.error("Use recursive option with and only with directories.")
             raise NotADirectoryError(args.source)
 
     @classmethod
-    def get_mode(cls, args):
+    def get_mode(cls, args, path_info: PathInfo):
         """
         Determine the mode of execution of the program.
         """
@@ -116,7 +829,7 @@ class Converter(object, metaclass=ABCMeta):
                 mode = ExecutionMode.all_in_place
         else:
             if target:
-                if os.path.isdir(target):
+                if path_info.target_is_dir:
                     logger.info("Mode: Convert file to target directory")
                     mode = ExecutionMode.file_to_dir
                 else:
@@ -132,70 +845,75 @@ class Converter(object, metaclass=ABCMeta):
         """
         Determine the source and target paths.
         """
-
-        if mode == ExecutionMode.file_to_file:
-            source_dir, source_filename = os.path.split(args.source)
-            # Different name, different dir
-            target_dir, target_filename = os.path.split(args.target)
-            # Verify filename
-            if not target_filename.endswith(self.target_ext):
-                target_filename += self.target_ext
-
-        elif mode == ExecutionMode.file_to_dir:
-            source_dir, source_filename = os.path.split(args.source)
-            # Same name, target dir
-            target_dir = args.target
-            target_filename = os.path.splitext(os.path.basename(args.source))[0] + self.target_ext
-
-        elif mode == ExecutionMode.file_in_place:
-            source_dir = args.source
-            source_filename = None
-            # same name, same dir
-            target_dir = os.path.split(args.source)[0]
-            target_filename = os.path.splitext(os.path.basename(args.source))[0] + self.target_ext
-
-        elif mode == ExecutionMode.all_to_dir:
-            source_dir = args.source
-            source_filename = None
-            # same names, target dir
-            target_dir = args.target
-            target_filename = None
-
-        elif mode == ExecutionMode.all_in_place:
-            source_dir = args.source
-            source_filename = None
-            # same names, same dir
-            target_dir = args.source
-            target_filename = None
-
-        else:
-            raise ValueError()
-
-        # Source is file or directory?
-        if source_filename is None:
-            source_path = source_dir
-        else:
-            source_path = os.path.join(source_dir, source_filename)
-
-        # Target is file or directory?
-        if target_filename is None:
-            target_path = target_dir
-        else:
-            target_path = os.path.join(target_dir, target_filename)
-
-        return source_path, target_path
-
-    def do_conversion(self, mode: ExecutionMode, source_path: str, target_path: str, skip: bool) -> None:
+        try:
+            path_handler = self._path_handlers[mode]
+        except KeyError:
+            raise ValueError(mode)
+
+        # Name of the source file without its extension
+        source_stem = os.path.splitext(os.path.basename(args.source))[0]
+
+        return path_handler(args, source_stem)
+
+    def _paths_file_to_file(self, args, source_stem: str):
+        # Different name, different dir
+        target_dir, target_filename = os.path.split(args.target)
+        # Verify filename
+        if not target_filename.endswith(self.target_ext):
+            target_filename += self.target_ext
+        return args.source, os.path.join(target_dir, target_filename)
+
+    def _paths_file_to_dir(self, args, source_stem: str):
+        # Same name, target dir
+        return args.source, os.path.join(args.target, source_stem + self.target_ext)
+
+    def _paths_file_in_place(self, args, source_stem: str):
+        # Same name, same dir
+        return args.source, os.path.join(os.path.dirname(args.source), source_stem + self.target_ext)
+
+    def _paths_all_to_dir(self, args, source_stem: str):
+        # Same names, target dir
+        return args.source, args.target
+
+    def _paths_all_in_place(self, args, source_stem: str):
+        # Same names, same dir
+        return args.source, args.source
+
+    def do_conversion(self, mode: ExecutionMode, source_path: str, target_path: str, skip: bool,
+                      jobs: int = None, backend: str = "auto", bundle_path: str = None,
+                      compress: str = "none") -> None:
         """
         Do the appropriate conversion based on program mode.
         """
+        if bundle_path:
+            # A bundle replaces the per-file targets, so options about those targets can't apply
+            if mode not in [ExecutionMode.all_in_place, ExecutionMode.all_to_dir]:
+                logger.error("Use bundle option only with the recursive option.")
+                raise ValueError(bundle_path)
+            if mode == ExecutionMode.all_to_dir:
+                logger.error("Use bundle option only without the target option.")
+                raise ValueError(target_path)
+            if skip:
+                logger.error("Use bundle option only without the skip option.")
+                raise ValueError(bundle_path)
+            if self.target_ext != ".npz":
+                logger.error("Use bundle option only when converting to single .npz files.")
+                raise ValueError(self.target_ext)
+            if backend == "process":
+                logger.error("Use bundle option only with the thread backend.")
+                raise ValueError(backend)
+
         if mode in [
             ExecutionMode.all_in_place,
             ExecutionMode.all_to_dir
         ]:
             # Get all source files
-            source_paths = glob.glob(os.path.join(source_path, "*" + self.source_ext))
-            self.convert_files(source_paths, target_path, skip)
+            source_paths = iter_source_paths(source_path, self.source_ext)
+            if bundle_path:
+                with NpzBundle(bundle_path, compress) as bundle:
+                    self.convert_files(source_paths, target_path, skip, jobs, backend, bundle)
+            else:
+                self.convert_files(source_paths, target_path, skip, jobs, backend)
 
         else:
             self.convert_file(source_path, target_path, skip)
@@ -0,0 +1 @@
+# Lets the tests import the scripts' modules (e.g. common.common) from the repository root
@@ -19,38 +19,89 @@ import argparse
 import sys
 import logging
 import os
+import tempfile
 
 import numpy
-import scipy.io
 import scipy.sparse
 
-from ..common.common import Converter, logger_format, logger_dateformat
+from ..common.common import (
+    COMPRESSION_POLICIES, Converter, PathInfo, read_mtx, read_mtx_array_to_memmap, read_mtx_header, save_array_chunks,
+    save_array_npz, should_stream_mtx_array, stream_mtx_array_to_npz, logger_format, logger_dateformat)
 
 logger = logging.getLogger()
 
 
 class DenseMtxToNpzConverter(Converter):
-    def __init__(self):
-        super().__init__(source_ext=".mtx", target_ext=".npz")
-
-    def convert_file(self, source_path: str, target_path: str, skip: bool) -> None:
+    def __init__(self, chunks: int = 1, compress: str = "none"):
+        # Chunks are written as uncompressed .npy shards
+        if chunks > 1 and compress != "none":
+            logger.error("Use compress option only without chunks.")
+            raise ValueError(compress)
+
+        # With more than one chunk, the target is the json index of the .npy shards
+        super().__init__(source_ext=".mtx", target_ext=".npz" if chunks <= 1 else ".json")
+        # Number of row-slab shards to write concurrently
+        self.chunks = chunks
+        # One of COMPRESSION_POLICIES, for .npz targets
+        self.compress = compress
+
+    def convert_file(self, source_path: str, target_path: str, skip: bool, parallelism: int = None) -> None:
+        source_filename = os.path.basename(source_path)
+        target_filename = os.path.basename(target_path)
 
         # Make sure we're not about to overwrite something:
         if os.path.isfile(target_path):
             if skip:
-                logger.info(
-                    f"{os.path.basename(target_path)} already exists, so skipping {os.path.basename(source_path)}")
+                logger.info("%s already exists, so skipping %s", target_filename, source_filename)
                 return
             else:
                 raise FileExistsError(target_path)
 
         # Load and convert the file
-        logger.info(f"Loading {os.path.basename(source_path)}")
-        matrix = scipy.io.mmread(source_path)
+        logger.info("Loading %s", source_filename)
+        memmap_path = None
+        matrix = None
+        try:
+            with open(source_path) as source_file:
+                header = read_mtx_header(source_file)
+                if should_stream_mtx_array(header):
+                    if self.chunks <= 1:
+                        # Parse and save in a single pass
+                        logger.info("Saving %s", target_filename)
+                        stream_mtx_array_to_npz(source_file, header, target_path, self.compress)
+                        return
+                    # A unique name next to the target, so no existing file is overwritten
+                    memmap_fd, memmap_path = tempfile.mkstemp(suffix=".tmp",
+                                                              dir=os.path.dirname(os.path.abspath(target_path)))
+                    os.close(memmap_fd)
+                    matrix = read_mtx_array_to_memmap(source_file, header, memmap_path)
+
+            if matrix is None:
+                matrix = self.load_matrix(source_path, parallelism)
+
+            # Save the file
+            logger.info("Saving %s", target_filename)
+            if self.chunks > 1:
+                save_array_chunks(target_path, matrix, self.chunks)
+            else:
+                save_array_npz(target_path, matrix, self.compress)
+
+        finally:
+            matrix = None
+            if memmap_path is not None:
+                os.remove(memmap_path)
 
-        # Save the file
-        logger.info(f"Saving {os.path.basename(target_path)}")
-        numpy.savez(target_path, matrix)
+    def load_matrix(self, source_path: str, parallelism: int = None) -> numpy.ndarray:
+        """
+        Load a single file into memory as a dense array.
+        """
+        matrix = read_mtx(source_path, parallelism=parallelism)
+        if scipy.sparse.issparse(matrix):
+            matrix = matrix.toarray()
+        return matrix
+
+    def load_arrays(self, source_path: str, parallelism: int = None):
+        return {"arr_0": self.load_matrix(source_path, parallelism)}
 
 
 def main(args):
@@ -58,20 +109,23 @@ def main(args):
     Entry point.
     """
 
-    converter = DenseMtxToNpzConverter()
+    converter = DenseMtxToNpzConverter(chunks=args.chunks, compress=args.compress)
+
+    path_info = PathInfo.from_args(args)
 
-    converter.validate_args(args)
+    converter.validate_args(args, path_info)
 
-    mode, skip = converter.get_mode(args)
+    mode, skip = converter.get_mode(args, path_info)
 
     source_path, target_path = converter.get_paths(args, mode)
 
-    converter.do_conversion(mode, source_path, target_path, skip)
+    converter.do_conversion(mode, source_path, target_path, skip, args.jobs, args.backend,
+                            bundle_path=args.bundle, compress=args.compress)
 
 
 if __name__ == '__main__':
     logging.basicConfig(format=logger_format, datefmt=logger_dateformat, level=logging.INFO)
-    logger.info("Running %s" % " ".join(sys.argv))
+    logger.info("Running %s", " ".join(sys.argv))
 
     parser = argparse.ArgumentParser(description='Convert matrix market text files to npz files.')
 
@@ -80,6 +134,20 @@ if __name__ == '__main__':
     parser.add_argument("--recursive", "-r", action="store_true", help="Convert all files in source directory. "
                                                                        "'source' must be a a directory")
     parser.add_argument("--skip", "-s", action="store_true", help="Skip existing files.")
+    parser.add_argument("--compress", "-z", choices=list(COMPRESSION_POLICIES), default="none",
+                        help="Compression of the .npz files: 'none' is fastest, 'fast' and 'best' deflate "
+                             "with level 1 and level 9. Not for '--chunks', whose .npy shards are uncompressed.")
+    parser.add_argument("--bundle", metavar="PATH", type=str,
+                        help="With '-r', convert all files into a single .npz bundle at PATH, with each matrix "
+                             "stored under its name, instead of one file each.")
+    parser.add_argument("--jobs", "-j", metavar="N", type=int, help="Number of files to convert in parallel with "
+                                                                     "'-r'. Defaults to the number of CPUs.")
+    parser.add_argument("--backend", choices=["auto", "thread", "process"], default="auto",
+                        help="Convert files in parallel using threads or processes. 'auto' uses threads when "
+                             "fast_matrix_market or scipy 1.12+ is installed, and processes otherwise.")
+    parser.add_argument("--chunks", "-k", metavar="K", type=int, default=1,
+                        help="Write each matrix as K row-slab .npy shards in parallel, with a .json index, "
+                             "instead of a single .npz.")
 
     main(parser.parse_args())
 
@@ -20,36 +20,44 @@ import logging
 import os
 
 import numpy
-import scipy.io
 import scipy.sparse
 
-from ..common.common import Converter, logger_format, logger_dateformat
+from ..common.common import (
+    Converter, PathInfo, load_array_chunks, write_mtx, logger_format, logger_dateformat)
 
 logger = logging.getLogger()
 
 
 class DenseNpzToMtxConverter(Converter):
-    def __init__(self):
-        super().__init__(source_ext=".npz", target_ext=".mtx")
+    def __init__(self, chunked: bool = False, detect_symmetry: bool = False):
+        # Chunked sources are the json indices written by DenseMtxToNpzConverter with chunks
+        super().__init__(source_ext=".npz" if not chunked else ".json", target_ext=".mtx")
+        self.chunked = chunked
+        # Check for symmetry when writing, rather than writing as general
+        self.detect_symmetry = detect_symmetry
 
-    def convert_file(self, source_path: str, target_path: str, skip: bool) -> None:
+    def convert_file(self, source_path: str, target_path: str, skip: bool, parallelism: int = None) -> None:
+        source_filename = os.path.basename(source_path)
+        target_filename = os.path.basename(target_path)
 
         # Make sure we're not about to overwrite something:
         if os.path.isfile(target_path):
             if skip:
-                logger.info(
-                    f"{os.path.basename(target_path)} already exists, so skipping {os.path.basename(source_path)}")
+                logger.info("%s already exists, so skipping %s", target_filename, source_filename)
                 return
             else:
                 raise FileExistsError(target_path)
 
         # Load the file
-        logger.info(f"Loading {os.path.basename(source_path)}")
-        matrix = numpy.load(source_path)["arr_0"]
+        logger.info("Loading %s", source_filename)
+        if self.chunked:
+            matrix = load_array_chunks(source_path)
+        else:
+            matrix = numpy.load(source_path)["arr_0"]
 
         # Save the file
-        logger.info(f"Saving {os.path.basename(target_path)}")
-        scipy.io.mmwrite(target_path, matrix, symmetry="general")
+        logger.info("Saving %s", target_filename)
+        write_mtx(target_path, matrix, detect_symmetry=self.detect_symmetry, parallelism=parallelism)
 
 
 def main(args):
@@ -57,20 +65,22 @@ def main(args):
     Entry point.
     """
 
-    converter = DenseNpzToMtxConverter()
+    converter = DenseNpzToMtxConverter(chunked=args.chunked, detect_symmetry=args.detect_symmetry)
 
-    converter.validate_args(args)
+    path_info = PathInfo.from_args(args)
 
-    mode, skip = converter.get_mode(args)
+    converter.validate_args(args, path_info)
+
+    mode, skip = converter.get_mode(args, path_info)
 
     source_path, target_path = converter.get_paths(args, mode)
 
-    converter.do_conversion(mode, source_path, target_path, skip)
+    converter.do_conversion(mode, source_path, target_path, skip, args.jobs, args.backend)
 
 
 if __name__ == '__main__':
     logging.basicConfig(format=logger_format, datefmt=logger_dateformat, level=logging.INFO)
-    logger.info("Running %s" % " ".join(sys.argv))
+    logger.info("Running %s", " ".join(sys.argv))
 
     parser = argparse.ArgumentParser(description='Convert npz files to matrix market text files.')
 
@@ -79,6 +89,15 @@ if __name__ == '__main__':
     parser.add_argument("--recursive", "-r", action="store_true", help="Convert all files in source directory. "
                                                                        "'source' must be a a directory")
     parser.add_argument("--skip", "-s", action="store_true", help="Skip existing files.")
+    parser.add_argument("--detect-symmetry", action="store_true",
+                        help="Write symmetric matrices as symmetric .mtx files. Slower, as every matrix is checked.")
+    parser.add_argument("--jobs", "-j", metavar="N", type=int, help="Number of files to convert in parallel with "
+                                                                     "'-r'. Defaults to the number of CPUs.")
+    parser.add_argument("--backend", choices=["auto", "thread", "process"], default="auto",
+                        help="Convert files in parallel using threads or processes. 'auto' uses threads when "
+                             "fast_matrix_market or scipy 1.12+ is installed, and processes otherwise.")
+    parser.add_argument("--chunked", action="store_true",
+                        help="Sources are the .json indices of chunked files written with '--chunks'.")
 
     main(parser.parse_args())
 
@@ -20,37 +20,66 @@ import sys
 import logging
 import os
 
-import scipy.io
-import scipy.sparse
-
-from common.common import Converter, logger_format, logger_dateformat
+from common.common import (
+    COMPRESSION_POLICIES, Converter, PathInfo, load_binsparse, narrow_sparse_dtypes, read_mtx_csr, save_sparse_h5,
+    save_sparse_npz, sparse_npz_arrays, logger_format, logger_dateformat)
 
 logger = logging.getLogger()
 
 
 class MtxToNpzConverter(Converter):
-    def __init__(self):
-        super().__init__(source_ext=".mtx", target_ext=".npz")
-
-    def convert_file(self, source_path: str, target_path: str, skip: bool) -> None:
+    def __init__(self, compress: str = "none", target_format: str = "npz", binary: bool = False,
+                 narrow_values: bool = False):
+        # HDF5 files are always lzf-compressed
+        if target_format != "npz" and compress != "none":
+            logger.error("Use compress option only with npz format.")
+            raise ValueError(compress)
+
+        super().__init__(source_ext=".mtx" if not binary else ".bsp", target_ext="." + target_format)
+        # One of COMPRESSION_POLICIES, for npz targets
+        self.compress = compress
+        # "npz" or "h5"
+        self.target_format = target_format
+        # Read binsparse files instead of matrix market text
+        self.binary = binary
+        # Store integer values in the narrowest dtype which holds them
+        self.narrow_values = narrow_values
+
+    def convert_file(self, source_path: str, target_path: str, skip: bool, parallelism: int = None) -> None:
+        source_filename = os.path.basename(source_path)
+        target_filename = os.path.basename(target_path)
 
         # Make sure we're not about to overwrite something:
         if os.path.isfile(target_path):
             if skip:
-                logger.info(
-                    f"{os.path.basename(target_path)} already exists, so skipping {os.path.basename(source_path)}")
+                logger.info("%s already exists, so skipping %s", target_filename, source_filename)
                 return
             else:
                 raise FileExistsError(target_path)
 
         # Load and convert the file
-        logger.info(f"Loading {os.path.basename(source_path)}")
-        matrix = scipy.io.mmread(source_path).tocsr()
+        logger.info("Loading %s", source_filename)
+        matrix = self.load_matrix(source_path, parallelism)
 
         # Save the file
-        logger.info(f"Saving {os.path.basename(target_path)}")
-        # Don't compress, to save memory.  TODO: does this actually save memory?
-        scipy.sparse.save_npz(target_path, matrix, compressed=False)
+        logger.info("Saving %s", target_filename)
+        if self.target_format == "h5":
+            save_sparse_h5(target_path, matrix)
+        else:
+            save_sparse_npz(target_path, matrix, self.compress)
+
+    def load_matrix(self, source_path: str, parallelism: int = None):
+        """
+        Load a single file as a CSR matrix.
+        """
+        if self.binary:
+            matrix = load_binsparse(source_path)
+        else:
+            matrix = read_mtx_csr(source_path, parallelism=parallelism)
+        return narrow_sparse_dtypes(matrix, self.narrow_values)
+
+    def load_arrays(self, source_path: str, parallelism: int = None):
+        return sparse_npz_arrays(self.load_matrix(source_path, parallelism))
 
 
 def main(args):
@@ -58,20 +87,24 @@ def main(args):
     Entry point.
     """
 
-    converter = MtxToNpzConverter()
+    converter = MtxToNpzConverter(compress=args.compress, target_format=args.format, binary=args.binary,
+                                  narrow_values=args.narrow_values)
+
+    path_info = PathInfo.from_args(args)
 
-    converter.validate_args(args)
+    converter.validate_args(args, path_info)
 
-    mode, skip = converter.get_mode(args)
+    mode, skip = converter.get_mode(args, path_info)
 
     source_path, target_path = converter.get_paths(args, mode)
 
-    converter.do_conversion(mode, source_path, target_path, skip)
+    converter.do_conversion(mode, source_path, target_path, skip, args.jobs, args.backend,
+                            bundle_path=args.bundle, compress=args.compress)
 
 
 if __name__ == '__main__':
     logging.basicConfig(format=logger_format, datefmt=logger_dateformat, level=logging.INFO)
-    logger.info("Running %s" % " ".join(sys.argv))
+    logger.info("Running %s", " ".join(sys.argv))
 
     parser = argparse.ArgumentParser(description='Convert matrix market text files to npz files.')
 
@@ -80,6 +113,23 @@ if __name__ == '__main__':
     parser.add_argument("--recursive", "-r", action="store_true", help="Convert all files in source directory. "
                                                                        "'source' must be a a directory")
     parser.add_argument("--skip", "-s", action="store_true", help="Skip existing files.")
+    parser.add_argument("--compress", "-z", choices=list(COMPRESSION_POLICIES), default="none",
+                        help="Compression of the .npz files: 'none' is fastest, 'fast' and 'best' deflate "
+                             "with level 1 and level 9. Not for '--format h5', which always uses lzf.")
+    parser.add_argument("--format", "-f", choices=["npz", "h5"], default="npz",
+                        help="Save as scipy .npz files, or as HDF5 .h5 files (requires h5py).")
+    parser.add_argument("--binary", "-b", action="store_true",
+                        help="Convert binsparse .bsp files (HDF5, requires h5py) instead of .mtx text files.")
+    parser.add_argument("--narrow-values", action="store_true",
+                        help="Store integer values in the narrowest integer type which holds them exactly.")
+    parser.add_argument("--bundle", metavar="PATH", type=str,
+                        help="With '-r', convert all files into a single .npz bundle at PATH, with each matrix's "
+                             "arrays stored under its name, instead of one file each.")
+    parser.add_argument("--jobs", "-j", metavar="N", type=int, help="Number of files to convert in parallel with "
+                                                                     "'-r'. Defaults to the number of CPUs.")
+    parser.add_argument("--backend", choices=["auto", "thread", "process"], default="auto",
+                        help="Convert files in parallel using threads or processes. 'auto' uses threads when "
+                             "fast_matrix_market or scipy 1.12+ is installed, and processes otherwise.")
 
     main(parser.parse_args())
 
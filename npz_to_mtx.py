@@ -20,36 +20,49 @@ import sys
 import logging
 import os
 
-import scipy.io
 import scipy.sparse
 
-from common.common import Converter, logger_format, logger_dateformat
+from common.common import (
+    Converter, PathInfo, load_sparse_h5, save_binsparse, write_mtx, logger_format, logger_dateformat)
 
 logger = logging.getLogger()
 
 
 class NpzToMtxConverter(Converter):
-    def __init__(self):
-        super().__init__(source_ext=".npz", target_ext=".mtx")
-
-    def convert_file(self, source_path: str, target_path: str, skip: bool) -> None:
+    def __init__(self, source_format: str = "npz", binary: bool = False, detect_symmetry: bool = False):
+        super().__init__(source_ext="." + source_format, target_ext=".mtx" if not binary else ".bsp")
+        # "npz" or "h5"
+        self.source_format = source_format
+        # Write binsparse files instead of matrix market text
+        self.binary = binary
+        # Check for symmetry when writing .mtx files, rather than writing them as general
+        self.detect_symmetry = detect_symmetry
+
+    def convert_file(self, source_path: str, target_path: str, skip: bool, parallelism: int = None) -> None:
+        source_filename = os.path.basename(source_path)
+        target_filename = os.path.basename(target_path)
 
         # Make sure we're not about to overwrite something:
         if os.path.isfile(target_path):
             if skip:
-                logger.info(
-                    f"{os.path.basename(target_path)} already exists, so skipping {os.path.basename(source_path)}")
+                logger.info("%s already exists, so skipping %s", target_filename, source_filename)
                 return
             else:
                 raise FileExistsError(target_path)
 
         # Load the file
-        logger.info(f"Loading {os.path.basename(source_path)}")
-        matrix = scipy.sparse.load_npz(source_path).tocsr()
+        logger.info("Loading %s", source_filename)
+        if self.source_format == "h5":
+            matrix = load_sparse_h5(source_path)
+        else:
+            matrix = scipy.sparse.load_npz(source_path).tocsr()
 
         # Save the file
-        logger.info(f"Saving {os.path.basename(target_path)}")
-        scipy.io.mmwrite(target_path, matrix, symmetry="general")
+        logger.info("Saving %s", target_filename)
+        if self.binary:
+            save_binsparse(target_path, matrix)
+        else:
+            write_mtx(target_path, matrix, detect_symmetry=self.detect_symmetry, parallelism=parallelism)
 
 
 def main(args):
@@ -57,20 +70,23 @@ def main(args):
     Entry point.
     """
 
-    converter = NpzToMtxConverter()
+    converter = NpzToMtxConverter(source_format=args.format, binary=args.binary,
+                                  detect_symmetry=args.detect_symmetry)
+
+    path_info = PathInfo.from_args(args)
 
-    converter.validate_args(args)
+    converter.validate_args(args, path_info)
 
-    mode, skip = converter.get_mode(args)
+    mode, skip = converter.get_mode(args, path_info)
 
     source_path, target_path = converter.get_paths(args, mode)
 
-    converter.do_conversion(mode, source_path, target_path, skip)
+    converter.do_conversion(mode, source_path, target_path, skip, args.jobs, args.backend)
 
 
 if __name__ == '__main__':
     logging.basicConfig(format=logger_format, datefmt=logger_dateformat, level=logging.INFO)
-    logger.info("Running %s" % " ".join(sys.argv))
+    logger.info("Running %s", " ".join(sys.argv))
 
     parser = argparse.ArgumentParser(description='Convert npz files to matrix market text files.')
 
@@ -79,6 +95,17 @@ if __name__ == '__main__':
     parser.add_argument("--recursive", "-r", action="store_true", help="Convert all files in source directory. "
                                                                        "'source' must be a a directory")
     parser.add_argument("--skip", "-s", action="store_true", help="Skip existing files.")
+    parser.add_argument("--format", "-f", choices=["npz", "h5"], default="npz",
+                        help="Convert scipy .npz files, or HDF5 .h5 files written by mtx_to_npz.py (requires h5py).")
+    parser.add_argument("--binary", "-b", action="store_true",
+                        help="Write binsparse .bsp files (HDF5, requires h5py) instead of .mtx text files.")
+    parser.add_argument("--detect-symmetry", action="store_true",
+                        help="Write symmetric matrices as symmetric .mtx files. Slower, as every matrix is checked.")
+    parser.add_argument("--jobs", "-j", metavar="N", type=int, help="Number of files to convert in parallel with "
+                                                                     "'-r'. Defaults to the number of CPUs.")
+    parser.add_argument("--backend", choices=["auto", "thread", "process"], default="auto",
+                        help="Convert files in parallel using threads or processes. 'auto' uses threads when "
+                             "fast_matrix_market or scipy 1.12+ is installed, and processes otherwise.")
 
     main(parser.parse_args())
 
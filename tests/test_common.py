@@ -0,0 +1,204 @@
+import io
+
+import numpy
+import pytest
+import scipy.sparse
+
+from common.common import (
+    NpzBundle, iter_mtx_array_values, iter_mtx_entries, load_array_chunks, load_binsparse, load_sparse_h5,
+    narrow_sparse_dtypes, read_mtx_array_to_memmap, read_mtx_header, save_array_chunks, save_arrays_npz,
+    save_binsparse, save_sparse_h5, save_sparse_npz, sparse_npz_arrays, stream_mtx_array_to_npz)
+
+
+def _open_mtx(text: str):
+    source_file = io.StringIO(text)
+    return source_file, read_mtx_header(source_file)
+
+
+def test_stream_array_to_npz(tmp_path):
+    source_file, header = _open_mtx("%%MatrixMarket matrix array real general\n2 3\n1\n2\n3\n4\n5\n6\n")
+    target_path = str(tmp_path / "matrix.npz")
+
+    stream_mtx_array_to_npz(source_file, header, target_path)
+
+    with numpy.load(target_path) as npz:
+        numpy.testing.assert_array_equal(npz["arr_0"], [[1, 3, 5], [2, 4, 6]])
+
+
+def test_stream_truncated_array_to_npz(tmp_path):
+    source_file, header = _open_mtx("%%MatrixMarket matrix array real general\n2 3\n1\n2\n3\n4\n5\n")
+    target_path = tmp_path / "matrix.npz"
+
+    with pytest.raises(ValueError, match="Truncated"):
+        stream_mtx_array_to_npz(source_file, header, str(target_path))
+    assert not target_path.exists()
+
+
+def test_stream_overlong_array_to_npz(tmp_path):
+    source_file, header = _open_mtx("%%MatrixMarket matrix array real general\n2 1\n1\n2\n3\n")
+    target_path = tmp_path / "matrix.npz"
+
+    with pytest.raises(ValueError, match="Too many"):
+        stream_mtx_array_to_npz(source_file, header, str(target_path))
+    assert not target_path.exists()
+
+
+def test_read_truncated_array_to_memmap(tmp_path):
+    source_file, header = _open_mtx("%%MatrixMarket matrix array real general\n2 3\n1\n2\n3\n4\n5\n")
+
+    with pytest.raises(ValueError, match="Truncated"):
+        read_mtx_array_to_memmap(source_file, header, str(tmp_path / "matrix.tmp"))
+
+
+def test_iter_complex_array_values():
+    source_file, header = _open_mtx("%%MatrixMarket matrix array complex general\n2 1\n1 2\n% comment\n3 4\n\n")
+
+    values = numpy.concatenate(list(iter_mtx_array_values(source_file, header)))
+
+    numpy.testing.assert_array_equal(values, [1 + 2j, 3 + 4j])
+
+
+def test_iter_array_values_across_blank_lines():
+    source_file, header = _open_mtx("%%MatrixMarket matrix array real general\n2 1\n1\n\n\n2\n")
+
+    values = numpy.concatenate(list(iter_mtx_array_values(source_file, header)))
+
+    numpy.testing.assert_array_equal(values, [1, 2])
+
+
+def test_iter_coordinate_entries_across_blank_lines():
+    source_file, header = _open_mtx("%%MatrixMarket matrix coordinate real general\n2 2 2\n1 1 1\n\n% comment\n2 2 2\n")
+    entry_dtype = numpy.dtype([("row", numpy.int32), ("col", numpy.int32), ("value", numpy.float64)])
+
+    entries = numpy.concatenate(list(iter_mtx_entries(source_file, header, entry_dtype)))
+
+    numpy.testing.assert_array_equal(entries["row"], [1, 2])
+    numpy.testing.assert_array_equal(entries["value"], [1, 2])
+
+
+@pytest.mark.parametrize("values, dtype", [
+    ([300, -2], numpy.int16),
+    ([-100, 100], numpy.int8),
+    ([-129, 1], numpy.int16),
+    ([1, 255], numpy.uint8),
+    ([1, 70000], numpy.uint32),
+    ([-2**31, 2**31 - 1], numpy.int32),
+])
+def test_narrow_sparse_values(values, dtype):
+    matrix = scipy.sparse.csr_matrix(numpy.array([values], dtype=numpy.int64))
+
+    narrowed = narrow_sparse_dtypes(matrix, narrow_values=True)
+
+    assert narrowed.data.dtype == dtype
+    numpy.testing.assert_array_equal(narrowed.data, values)
+
+
+@pytest.mark.parametrize("array", [
+    numpy.arange(12, dtype=numpy.float64).reshape(3, 4),
+    numpy.asfortranarray(numpy.arange(12, dtype=numpy.int32).reshape(3, 4)),
+    numpy.arange(12).reshape(3, 4)[:, ::2],
+    numpy.array([1 + 2j, 3 - 4j]),
+    numpy.array(7.5),
+    numpy.empty((0, 3)),
+], ids=["c-order", "f-order", "non-contiguous", "complex", "0-d", "empty"])
+def test_save_arrays_npz(tmp_path, array):
+    target_path = str(tmp_path / "arrays.npz")
+
+    save_arrays_npz(target_path, {"array": array, "other": numpy.arange(3)}, "fast")
+
+    with numpy.load(target_path) as npz:
+        assert npz["array"].dtype == array.dtype
+        numpy.testing.assert_array_equal(npz["array"], array)
+        numpy.testing.assert_array_equal(npz["other"], numpy.arange(3))
+
+
+def test_save_arrays_npz_long_header(tmp_path):
+    # Too many fields for a version 1.0 header
+    array = numpy.zeros(2, dtype=[(f"field_{i:05d}", numpy.int8) for i in range(4000)])
+    target_path = str(tmp_path / "arrays.npz")
+
+    save_arrays_npz(target_path, {"array": array})
+
+    with numpy.load(target_path, max_header_size=1 << 20) as npz:
+        assert npz["array"].dtype == array.dtype
+
+
+def test_save_arrays_npz_rejects_objects(tmp_path):
+    with pytest.raises(ValueError):
+        save_arrays_npz(str(tmp_path / "arrays.npz"), {"array": numpy.array([None, 1])})
+
+
+def _sparse_matrix() -> scipy.sparse.csr_matrix:
+    return scipy.sparse.csr_matrix(numpy.array([[0, 1.5, 0], [2, 0, 0], [0, 0, -3], [0, 0, 0]]))
+
+
+def _assert_sparse_equal(actual, expected):
+    assert actual.shape == expected.shape
+    assert actual.dtype == expected.dtype
+    numpy.testing.assert_array_equal(actual.toarray(), expected.toarray())
+
+
+def test_save_sparse_npz(tmp_path):
+    matrix = _sparse_matrix()
+    target_path = str(tmp_path / "matrix.npz")
+
+    save_sparse_npz(target_path, matrix)
+
+    _assert_sparse_equal(scipy.sparse.load_npz(target_path), matrix)
+
+
+def test_sparse_h5_round_trip(tmp_path):
+    pytest.importorskip("h5py")
+    matrix = _sparse_matrix()
+    target_path = str(tmp_path / "matrix.h5")
+
+    save_sparse_h5(target_path, matrix)
+
+    _assert_sparse_equal(load_sparse_h5(target_path), matrix)
+
+
+def test_binsparse_round_trip(tmp_path):
+    pytest.importorskip("h5py")
+    matrix = _sparse_matrix()
+    target_path = str(tmp_path / "matrix.bsp")
+
+    save_binsparse(target_path, matrix)
+
+    _assert_sparse_equal(load_binsparse(target_path), matrix)
+
+
+@pytest.mark.parametrize("chunks", [1, 3, 7])
+def test_array_chunks_round_trip(tmp_path, chunks):
+    array = numpy.asfortranarray(numpy.arange(30, dtype=numpy.float64).reshape(5, 6))
+    index_path = str(tmp_path / "matrix.json")
+
+    save_array_chunks(index_path, array, chunks)
+
+    numpy.testing.assert_array_equal(load_array_chunks(index_path), array)
+
+
+def test_npz_bundle(tmp_path):
+    matrix = _sparse_matrix()
+    dense = numpy.arange(6).reshape(2, 3)
+    bundle_path = str(tmp_path / "bundle.npz")
+
+    with NpzBundle(bundle_path) as bundle:
+        bundle.add("sparse", sparse_npz_arrays(matrix))
+        bundle.add("dense", {"arr_0": dense})
+
+    with numpy.load(bundle_path) as npz:
+        assert sorted(npz.files) == sorted(["dense/arr_0"] + [f"sparse/{key}" for key in sparse_npz_arrays(matrix)])
+        numpy.testing.assert_array_equal(npz["dense/arr_0"], dense)
+        loaded = scipy.sparse.csr_matrix((npz["sparse/data"], npz["sparse/indices"], npz["sparse/indptr"]),
+                                         shape=tuple(npz["sparse/shape"]))
+    _assert_sparse_equal(loaded, matrix)
+
+
+def test_npz_bundle_removed_on_error(tmp_path):
+    bundle_path = tmp_path / "bundle.npz"
+
+    with pytest.raises(RuntimeError):
+        with NpzBundle(str(bundle_path)) as bundle:
+            bundle.add("dense", {"arr_0": numpy.arange(3)})
+            raise RuntimeError()
+    assert not bundle_path.exists()